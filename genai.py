@@ -1,6 +1,22 @@
 import os
+import json
+import hashlib
+import threading
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import db, AICache, AISemanticCache
 
 
 load_dotenv()
@@ -8,6 +24,14 @@ load_dotenv()
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_EMBEDDINGS_URL = "https://openrouter.ai/api/v1/embeddings"
+
+CHAT_MODEL = "openai/gpt-4o-mini"
+CLASSIFIER_MODEL = os.getenv("OPENROUTER_CLASSIFIER_MODEL", CHAT_MODEL)
+EMBEDDING_MODEL = "openai/text-embedding-3-small"
+SEMANTIC_THRESHOLD = 0.95
+SEMANTIC_MAX_ROWS = 10000
+RETRY_AFTER_MAX = 5
 
 
 headers = {
@@ -15,62 +39,337 @@ headers = {
     "Content-Type": "application/json"
 }
 
-def simplify_recipe(instructions: str) -> str:
-    """
-    Simplify recipe instructions using OpenRouter AI.
-    """
-    prompt = f"Simplify the following recipe instructions for beginners in easy language:\n\n{instructions}"
-
-    payload = {
-        "model": "openai/gpt-4o-mini",
-        "messages": [
-            {"role": "user", "content": prompt}
-        ],
-        "temperature": 0.4,
-        "max_tokens": 500
-    }
+_SIMPLIFY_TEMPLATE = "Simplify the following recipe instructions for beginners in easy language:\n\n{instructions}"
 
-    response = requests.post(OPENROUTER_URL, json=payload, headers=headers)
-    response.raise_for_status() 
+_VALIDATE_TEMPLATE = """
+Are all of these edible food ingredients? Reply with exactly one word: OK or INVALID.
 
-    data = response.json()
-    return data['choices'][0]['message']['content']
+Ingredients:
+{ingredients}
+"""
 
-def suggest_recipe(ingredients: str) -> str:
-    """
-    Suggest a recipe given a list of ingredients.
-    Returns "INVALID_INGREDIENTS" if input contains non-edible items.
-    """
-    prompt = f"""
+_SUGGEST_TEMPLATE = """
 You are a cooking assistant.
 
-Rules:
-- ONLY respond if all ingredients are edible food items.
-- If the input contains non-food items (e.g., clothes, phone, chair),
-respond exactly with:
-"INVALID_INGREDIENTS"
-
 Ingredients:
 {ingredients}
 
-If valid:
 - Suggest ONE recipe
 - Provide recipe name
 - Provide 3–4 simple steps
 """
 
-    payload = {
-        "model": "openai/gpt-4o-mini",
+class _CappedRetry(Retry):
+    """
+    Retry that honours Retry-After but never sleeps longer than RETRY_AFTER_MAX seconds.
+    """
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, RETRY_AFTER_MAX)
+
+# One pooled session so the TLS connection to openrouter.ai is reused across calls.
+# Rate limits, transient 5xx errors and failed connections are retried with
+# exponential backoff instead of surfacing as a 500 page. Read errors are not: the
+# request may already have reached OpenRouter (and been billed), and each retry
+# could wait out another full timeout.
+_session = requests.Session()
+_session.headers.update(headers)
+_session.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=_CappedRetry(
+        total=3,
+        read=0,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["POST"]),
+        respect_retry_after_header=True
+    )
+))
+
+# Embeddings are optional (a failure just skips the semantic cache), so they get
+# their own session with no retries and a short timeout.
+_embed_session = requests.Session()
+_embed_session.headers.update(headers)
+_embed_session.mount("https://", HTTPAdapter(max_retries=0))
+
+def _prompt_hash(model: str, temperature: float, prompt: str) -> str:
+    return hashlib.sha256(f"{model}|{temperature}|{prompt}".encode()).hexdigest()
+
+class _SemanticIndex:
+    """
+    Unit embeddings for one task in a single preallocated float32 matrix.
+    Capacity doubles as rows arrive, up to SEMANTIC_MAX_ROWS; after that the oldest
+    row is overwritten.
+    """
+
+    def __init__(self, dim: int):
+        self.matrix = np.empty((min(256, SEMANTIC_MAX_ROWS), dim), dtype=np.float32)
+        self.outputs = []
+        self.inserted = 0
+
+    def add(self, vector, output: str):
+        if vector.shape[0] != self.matrix.shape[1]:
+            return
+        if len(self.outputs) < SEMANTIC_MAX_ROWS:
+            if len(self.outputs) == len(self.matrix):
+                grown = np.empty((min(2 * len(self.matrix), SEMANTIC_MAX_ROWS), self.matrix.shape[1]),
+                                 dtype=np.float32)
+                grown[:len(self.matrix)] = self.matrix
+                self.matrix = grown
+            slot = len(self.outputs)
+            self.outputs.append(output)
+        else:
+            slot = self.inserted % SEMANTIC_MAX_ROWS
+            self.outputs[slot] = output
+        self.matrix[slot] = vector
+        self.inserted += 1
+
+    def best_match(self, vector):
+        if not self.outputs or vector.shape[0] != self.matrix.shape[1]:
+            return None
+        # Rows are unit vectors, so one matmul gives every cosine similarity.
+        scores = self.matrix[:len(self.outputs)] @ vector
+        best = int(np.argmax(scores))
+        return self.outputs[best] if scores[best] >= SEMANTIC_THRESHOLD else None
+
+# task -> _SemanticIndex, loaded lazily from ai_semantic_cache. Only committed rows are
+# added, via the after_commit hook below.
+_semantic_index = {}
+_semantic_lock = threading.Lock()
+
+def _embed(text: str):
+    """
+    Return the unit-normalised float32 embedding of text, or None if the endpoint fails.
+    """
+    payload = {"model": EMBEDDING_MODEL, "input": text}
+    try:
+        response = _embed_session.post(OPENROUTER_EMBEDDINGS_URL, json=payload, timeout=10)
+        response.raise_for_status()
+        vector = np.asarray(response.json()['data'][0]['embedding'], dtype=np.float32)
+    except (requests.RequestException, KeyError, IndexError, ValueError):
+        return None
+
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+def _load_semantic_index(task: str, dim: int) -> _SemanticIndex:
+    if task not in _semantic_index:
+        rows = AISemanticCache.query.filter_by(task=task).order_by(
+            AISemanticCache.id.desc()
+        ).limit(SEMANTIC_MAX_ROWS).all()
+        index = _SemanticIndex(dim)
+        for row in reversed(rows):
+            index.add(np.frombuffer(row.embedding, dtype=np.float32), row.output)
+        _semantic_index[task] = index
+    return _semantic_index[task]
+
+def _semantic_lookup(task: str, vector):
+    with _semantic_lock:
+        return _load_semantic_index(task, vector.shape[0]).best_match(vector)
+
+def _semantic_store(task: str, user_input: str, vector, output: str):
+    db.session.info.setdefault("semantic_pending", []).append((task, user_input, vector, output))
+
+@event.listens_for(Session, "before_commit")
+def _write_cache_rows(session):
+    # Cache rows are held in session.info until the caller commits, so no write
+    # (and, on SQLite, no database write lock) is held across an LLM call.
+    for task, user_input, vector, output in session.info.get("semantic_pending", ()):
+        session.add(AISemanticCache(
+            task=task,
+            user_input=user_input,
+            embedding=vector.tobytes(),
+            output=output
+        ))
+
+    pending = session.info.pop("cache_pending", None)
+    if not pending:
+        return
+
+    # Another worker may cache the same prompt concurrently; that must not abort the
+    # caller's commit (and its AIHistory row), so a conflicting insert is a no-op.
+    dialect = session.get_bind().dialect.name
+    for prompt_hash, output in pending.items():
+        if dialect in ("sqlite", "postgresql"):
+            insert = sqlite_insert if dialect == "sqlite" else postgresql_insert
+            session.execute(
+                insert(AICache)
+                .values(prompt_hash=prompt_hash, output=output, created_at=datetime.utcnow())
+                .on_conflict_do_nothing(index_elements=["prompt_hash"])
+            )
+            continue
+
+        try:
+            with session.begin_nested():
+                session.add(AICache(prompt_hash=prompt_hash, output=output))
+        except IntegrityError:
+            pass
+
+@event.listens_for(Session, "after_commit")
+def _publish_semantic_rows(session):
+    pending = session.info.pop("semantic_pending", None)
+    if not pending:
+        return
+    with _semantic_lock:
+        for task, user_input, vector, output in pending:
+            # Unloaded indexes will pick the row up from the database instead.
+            if task in _semantic_index:
+                _semantic_index[task].add(vector, output)
+
+@event.listens_for(Session, "after_rollback")
+def _drop_cache_rows(session):
+    session.info.pop("semantic_pending", None)
+    session.info.pop("cache_pending", None)
+
+def _cache_lookup(model: str, prompt: str, temperature: float, task: str, user_input: str):
+    """
+    Look for a stored answer: exact ai_cache row for (model, temperature, prompt) first,
+    then an ai_semantic_cache answer whose input embedding is near user_input
+    (skipped when user_input is None).
+
+    Returns (output, prompt_hash, semantic_task, vector); output is None on a miss.
+    """
+    prompt_hash = _prompt_hash(model, temperature, prompt)
+    pending = db.session.info.get("cache_pending", {})
+    if prompt_hash in pending:
+        return pending[prompt_hash], prompt_hash, None, None
+
+    cached = db.session.get(AICache, prompt_hash)
+    if cached is not None:
+        return cached.output, prompt_hash, None, None
+
+    # Semantic answers are only shared between calls with the same model settings.
+    semantic_task = f"{task}|{model}|{temperature}"
+    vector = _embed(user_input) if user_input is not None else None
+    output = _semantic_lookup(semantic_task, vector) if vector is not None else None
+    if output is not None:
+        # Pin the near match under this exact prompt, skipping the embedding call next time.
+        _cache_store(prompt_hash, output)
+    return output, prompt_hash, semantic_task, vector
+
+def _cache_store(prompt_hash: str, output: str, semantic_task=None, user_input=None, vector=None):
+    """
+    Queue cache rows on the session; they are written by the caller's commit, together
+    with its AIHistory entry, instead of costing a commit of their own.
+    """
+    if vector is not None:
+        _semantic_store(semantic_task, user_input, vector, output)
+
+    db.session.info.setdefault("cache_pending", {})[prompt_hash] = output
+
+def _payload(model: str, prompt: str, temperature: float, max_tokens: int) -> dict:
+    return {
+        "model": model,
         "messages": [
             {"role": "user", "content": prompt}
         ],
-        "temperature": 0.4,
-        "max_tokens": 500
+        "temperature": temperature,
+        "max_tokens": max_tokens
     }
 
-    response = requests.post(OPENROUTER_URL, json=payload, headers=headers)
+@lru_cache(maxsize=512)
+def _cached_call(model: str, prompt: str, temperature: float, max_tokens: int,
+                 task: str, user_input) -> str:
+    """
+    Send a chat completion to OpenRouter, reusing a stored answer when possible.
+    The lru_cache is an in-process L1 in front of the database caches.
+    """
+    output, prompt_hash, semantic_task, vector = _cache_lookup(
+        model, prompt, temperature, task, user_input
+    )
+    if output is not None:
+        return output
+
+    payload = _payload(model, prompt, temperature, max_tokens)
+    response = _session.post(OPENROUTER_URL, json=payload, timeout=60)
     response.raise_for_status()
 
     data = response.json()
-    return data['choices'][0]['message']['content'].strip()
+    output = data['choices'][0]['message']['content']
+
+    _cache_store(prompt_hash, output, semantic_task, user_input, vector)
+    return output
+
+def _streamed_call(model: str, prompt: str, temperature: float, max_tokens: int,
+                   task: str, user_input: str):
+    """
+    Like _cached_call, but yield the completion in chunks as OpenRouter generates it.
+    A cached answer is yielded as a single chunk.
+    """
+    output, prompt_hash, semantic_task, vector = _cache_lookup(
+        model, prompt, temperature, task, user_input
+    )
+    if output is not None:
+        yield output
+        return
+
+    payload = _payload(model, prompt, temperature, max_tokens)
+    payload["stream"] = True
+
+    chunks = []
+    with _session.post(OPENROUTER_URL, json=payload, timeout=60, stream=True) as response:
+        response.raise_for_status()
+
+        for line in response.iter_lines(decode_unicode=True):
+            # SSE: skip blank keep-alives and ": OPENROUTER PROCESSING" comments.
+            if not line or not line.startswith("data: "):
+                continue
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                break
+
+            choices = json.loads(data).get('choices') or [{}]
+            delta = choices[0].get('delta', {}).get('content')
+            if delta:
+                chunks.append(delta)
+                yield delta
+
+    if chunks:
+        _cache_store(prompt_hash, "".join(chunks), semantic_task, user_input, vector)
+
+def simplify_recipe(instructions: str) -> str:
+    """
+    Simplify recipe instructions using OpenRouter AI.
+    """
+    prompt = _SIMPLIFY_TEMPLATE.format(instructions=instructions)
+
+    # Exact cache only: instructions that differ by one ingredient embed almost
+    # identically but need different simplified steps.
+    return _cached_call(CHAT_MODEL, prompt, 0.4, 500, "simplify", None)
+
+def ingredients_are_valid(ingredients: str) -> bool:
+    """
+    Cheap first pass for suggestions: a few-token OK/INVALID classification.
+    """
+    prompt = _VALIDATE_TEMPLATE.format(ingredients=ingredients)
+
+    # No semantic lookup here: one extra non-food item barely moves the embedding
+    # but flips the answer.
+    answer = _cached_call(CLASSIFIER_MODEL, prompt, 0.0, 5, "validate", None)
+    return not answer.strip().strip('"').upper().startswith("INVALID")
+
+def suggest_recipe(ingredients: str) -> str:
+    """
+    Suggest a recipe given a list of ingredients.
+    Returns "INVALID_INGREDIENTS" if input contains non-edible items.
+    """
+    if not ingredients_are_valid(ingredients):
+        return "INVALID_INGREDIENTS"
+
+    prompt = _SUGGEST_TEMPLATE.format(ingredients=ingredients)
+
+    return _cached_call(CHAT_MODEL, prompt, 0.4, 250, "suggest", ingredients).strip()
+
+def stream_suggestion(ingredients: str):
+    """
+    Streaming variant of suggest_recipe: yields text chunks as they are generated.
+    """
+    if not ingredients_are_valid(ingredients):
+        yield "INVALID_INGREDIENTS"
+        return
+
+    prompt = _SUGGEST_TEMPLATE.format(ingredients=ingredients)
 
+    yield from _streamed_call(CHAT_MODEL, prompt, 0.4, 250, "suggest", ingredients)
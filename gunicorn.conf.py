@@ -0,0 +1,19 @@
+import os
+
+
+# gevent workers let each process keep many slow OpenRouter calls in flight at once.
+# Run with: gunicorn app:app
+bind = os.getenv("BIND", "0.0.0.0:5000")
+worker_class = "gevent"
+worker_connections = 1000
+
+# One worker by default: gevent already supplies the IO concurrency, and several
+# caches are per process (the home page SimpleCache and its invalidation, the
+# semantic-cache matrix, the lru_caches in app.py and genai.py), so extra workers
+# would serve stale pages and duplicate LLM calls. Job status is in the database,
+# so raising WEB_CONCURRENCY is safe for polling, but the caches stay per worker.
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# Log a warning whenever something blocks the gevent hub (CPU-bound work,
+# unpatched IO). Must be set before the workers import gevent.
+os.environ.setdefault("GEVENT_MONITOR_THREAD_ENABLE", "1")
@@ -0,0 +1,65 @@
+from datetime import datetime
+
+from flask_sqlalchemy import SQLAlchemy
+
+
+db = SQLAlchemy()
+
+
+
+class Recipe(db.Model):
+    __table_args__ = (
+        db.Index("ix_recipe_cuisine_veg", "cuisine", "isVegetarian"),
+    )
+
+    id = db.Column(db.String, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+    cuisine = db.Column(db.String, nullable=False)
+    isVegetarian = db.Column(db.Boolean, nullable=False, index=True)
+    prepTimeMinutes = db.Column(db.Integer, nullable=False, index=True)
+    ingredients = db.Column(db.Text, nullable=False)
+    difficulty = db.Column(db.String, nullable=False)
+    instructions = db.Column(db.Text, nullable=False)
+    tags = db.Column(db.Text, nullable=False)
+
+class AIHistory(db.Model):
+
+    id = db.Column(db.Integer, primary_key=True)
+    action_type = db.Column(db.String, nullable=False)
+    user_input = db.Column(db.Text, nullable=False)
+    ai_output = db.Column(db.Text, nullable=False)
+
+class AICache(db.Model):
+    """
+    Persistent LLM response cache, keyed by a SHA-256 of (model, temperature, prompt).
+    """
+    __tablename__ = "ai_cache"
+
+    prompt_hash = db.Column(db.String(64), primary_key=True)
+    output = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class AISemanticCache(db.Model):
+    """
+    LLM answers indexed by a unit-normalised embedding of the user's input.
+    """
+    __tablename__ = "ai_semantic_cache"
+
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String, nullable=False, index=True)
+    user_input = db.Column(db.Text, nullable=False)
+    embedding = db.Column(db.LargeBinary, nullable=False)
+    output = db.Column(db.Text, nullable=False)
+
+class AIJob(db.Model):
+    """
+    Status of a background AI call, shared by every worker that may be polled.
+    """
+    __tablename__ = "ai_job"
+
+    id = db.Column(db.String(32), primary_key=True)
+    # pending (queued) -> running -> finished | failed
+    status = db.Column(db.String, nullable=False, default="pending")
+    result = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime)
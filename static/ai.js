@@ -0,0 +1,86 @@
+// Submit AI forms in the background (streamed or polled) so the page
+// stays responsive; without JavaScript the forms still POST normally.
+(function () {
+  var POLL_INTERVAL_MS = 1000;
+
+  function poll(jobId, output, button) {
+    fetch("/ai/result/" + jobId)
+      .then(function (response) { return response.json(); })
+      .then(function (job) {
+        if (job.status === "pending") {
+          setTimeout(function () { poll(jobId, output, button); }, POLL_INTERVAL_MS);
+          return;
+        }
+        output.textContent = job.status === "finished"
+          ? job.result
+          : "Sorry, something went wrong. Please try again.";
+        button.disabled = false;
+      })
+      .catch(function () {
+        output.textContent = "Sorry, something went wrong. Please try again.";
+        button.disabled = false;
+      });
+  }
+
+  function submitJob(form, output, button) {
+    fetch(form.dataset.aiEndpoint, { method: "POST", body: new FormData(form) })
+      .then(function (response) {
+        if (!response.ok) { throw new Error(response.statusText); }
+        return response.json();
+      })
+      .then(function (job) { poll(job.job_id, output, button); })
+      .catch(function () {
+        output.textContent = "Sorry, something went wrong. Please try again.";
+        button.disabled = false;
+      });
+  }
+
+  // Show tokens as they arrive; fall back to a polled job if the stream fails
+  // before producing anything.
+  function stream(form, output, button) {
+    var params = new URLSearchParams(new FormData(form));
+    var source = new EventSource(form.dataset.aiStream + "?" + params.toString());
+    var started = false;
+
+    source.onmessage = function (event) {
+      var message = JSON.parse(event.data);
+      if (message.done) {
+        output.textContent = message.result;
+        button.disabled = false;
+        source.close();
+        return;
+      }
+      output.textContent = (started ? output.textContent : "") + message.delta;
+      started = true;
+    };
+
+    source.onerror = function () {
+      source.close();
+      if (started) {
+        button.disabled = false;
+      } else {
+        submitJob(form, output, button);
+      }
+    };
+  }
+
+  document.querySelectorAll("form[data-ai-endpoint]").forEach(function (form) {
+    form.addEventListener("submit", function (event) {
+      event.preventDefault();
+
+      var target = document.getElementById(form.dataset.aiTarget);
+      var output = target.querySelector("pre");
+      var button = form.querySelector("button");
+
+      button.disabled = true;
+      target.hidden = false;
+      output.textContent = "Thinking...";
+
+      if (form.dataset.aiStream && window.EventSource) {
+        stream(form, output, button);
+      } else {
+        submitJob(form, output, button);
+      }
+    });
+  });
+})();
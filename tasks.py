@@ -0,0 +1,85 @@
+import os
+import uuid
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from models import db, AIJob
+
+
+# Bounded pool for slow LLM calls so they don't hold a request worker while in flight.
+# Job status lives in the ai_job table so any worker can answer a poll.
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("AI_WORKERS", "4")))
+
+# Jobs still running this long after they started are reported as failed (e.g. the
+# worker running them was recycled); time spent queued behind other jobs doesn't
+# count. All jobs are deleted once older than JOB_TTL.
+JOB_TIMEOUT = timedelta(minutes=5)
+JOB_TTL = timedelta(hours=1)
+
+
+def enqueue(app, fn, *args) -> str:
+    """
+    Record a pending job, run fn(*args) on the background pool and return the job id.
+    """
+    AIJob.query.filter(AIJob.created_at < datetime.utcnow() - JOB_TTL).delete()
+    job_id = uuid.uuid4().hex
+    db.session.add(AIJob(id=job_id, status="pending"))
+    db.session.commit()
+
+    _executor.submit(_run, app, job_id, fn, args)
+    return job_id
+
+
+def _run(app, job_id, fn, args):
+    with app.app_context():
+        job = db.session.get(AIJob, job_id)
+        if job is None:
+            return
+        job.status = "running"
+        job.started_at = datetime.utcnow()
+        db.session.commit()
+
+        try:
+            result, status = fn(*args), "finished"
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("AI job %s failed", job_id)
+            result, status = None, "failed"
+
+        try:
+            _record(job_id, status, result)
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("Could not record the result of AI job %s", job_id)
+            try:
+                _record(job_id, "failed", None)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Could not mark AI job %s as failed", job_id)
+
+
+def _record(job_id, status, result):
+    job = db.session.get(AIJob, job_id)
+    if job is not None:
+        job.status = status
+        job.result = result
+        db.session.commit()
+
+
+def get_result(job_id: str):
+    """
+    Return the job's status dict, or None for unknown or expired ids.
+    Failures carry no detail; the exception is only logged server-side.
+    """
+    job = db.session.get(AIJob, job_id)
+    if job is None:
+        return None
+    if job.status == "pending":
+        return {"status": "pending"}
+    if job.status == "running":
+        if job.started_at < datetime.utcnow() - JOB_TIMEOUT:
+            return {"status": "failed"}
+        return {"status": "pending"}
+    if job.status == "failed":
+        return {"status": "failed"}
+    return {"status": "finished", "result": job.result}
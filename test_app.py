@@ -1,6 +1,546 @@
+import pytest
 from app import app
 
 def test_home_page():
     client = app.test_client()
     response = client.get("/")
     assert response.status_code == 200
+
+
+def test_history_page_is_compressed():
+    from models import db, AIHistory
+
+    with app.app_context():
+        db.session.add(AIHistory(action_type="Suggestion", user_input="rice", ai_output="x" * 1000))
+        db.session.commit()
+
+    client = app.test_client()
+    response = client.get("/history", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+
+
+def test_home_page_supports_etag():
+    client = app.test_client()
+    etag = client.get("/").headers["ETag"]
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+FLUSH_SCRIPT = """
+import threading
+from app import app
+from models import db, Recipe
+
+client = app.test_client()
+client.get("/")
+
+with app.app_context():
+    db.session.add(Recipe(
+        id="rec_flush", name="Flushed Pulao", cuisine="Indian", isVegetarian=True,
+        prepTimeMinutes=20, ingredients="rice", difficulty="Easy",
+        instructions="Cook rice.", tags="lunch"
+    ))
+    db.session.flush()
+    # Another request renders the page before this transaction commits.
+    reader = threading.Thread(target=client.get, args=("/",))
+    reader.start()
+    reader.join()
+    db.session.commit()
+
+print("Flushed Pulao" in client.get("/").get_data(as_text=True))
+"""
+
+
+def test_home_cache_is_cleared_on_commit_not_flush(tmp_path):
+    import os
+    import subprocess
+    import sys
+
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'flush.db'}")
+    result = subprocess.run(
+        [sys.executable, "-c", FLUSH_SCRIPT], env=env, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)), timeout=30
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "True"
+
+
+def test_home_etag_changes_when_a_recipe_is_edited():
+    from models import db, Recipe
+
+    with app.app_context():
+        db.session.add(Recipe(
+            id="rec_etag",
+            name="Aloo Gobi",
+            cuisine="Indian",
+            isVegetarian=True,
+            prepTimeMinutes=30,
+            ingredients="potato, cauliflower",
+            difficulty="Easy",
+            instructions="Cook potato and cauliflower with spices.",
+            tags="lunch"
+        ))
+        db.session.commit()
+
+    client = app.test_client()
+    etag = client.get("/").headers["ETag"]
+
+    with app.app_context():
+        db.session.get(Recipe, "rec_etag").name = "Aloo Gobi Masala"
+        db.session.commit()
+
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert b"Aloo Gobi Masala" in response.data
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+VOCAB = ["tomato", "onion", "paneer", "rice", "egg"]
+
+
+def fake_openrouter(monkeypatch, calls):
+    import genai
+
+    def fake_post(url, **kwargs):
+        if url == genai.OPENROUTER_EMBEDDINGS_URL:
+            # Bag-of-words "embedding" so reordered ingredient lists match.
+            words = {w.strip() for w in kwargs["json"]["input"].split(",")}
+            vector = [float(w in words) for w in VOCAB]
+            return FakeResponse({"data": [{"embedding": vector}]})
+        calls.append(kwargs["json"])
+        content = "OK" if kwargs["json"]["max_tokens"] == 5 else "Tomato Soup"
+        return FakeResponse({"choices": [{"message": {"content": content}}]})
+
+    monkeypatch.setattr(genai._session, "post", fake_post)
+    monkeypatch.setattr(genai._embed_session, "post", fake_post)
+    monkeypatch.setattr(genai, "_semantic_index", {})
+    genai._cached_call.cache_clear()
+
+
+def test_ai_responses_are_cached(monkeypatch):
+    import genai
+
+    calls = []
+    fake_openrouter(monkeypatch, calls)
+
+    from app import run_suggestion
+
+    with app.app_context():
+        assert run_suggestion("tomato, onion") == "Tomato Soup"
+
+    # A fresh session and empty L1 must still hit the committed ai_cache rows.
+    genai._cached_call.cache_clear()
+    with app.app_context():
+        assert genai.suggest_recipe("tomato, onion") == "Tomato Soup"
+
+    # One classification call plus one generation call.
+    assert len(calls) == 2
+
+
+LOCK_SCRIPT = """
+import threading, time
+import genai
+from app import app, run_suggestion
+from models import db, AIHistory
+
+class Reply:
+    def __init__(self, content):
+        self.content = content
+    def raise_for_status(self):
+        pass
+    def json(self):
+        return {"choices": [{"message": {"content": self.content}}]}
+
+def fake_post(url, **kwargs):
+    if url == genai.OPENROUTER_EMBEDDINGS_URL:
+        raise genai.requests.ConnectionError()
+    if kwargs["json"]["max_tokens"] == 5:
+        return Reply("OK")
+    time.sleep(1.5)
+    return Reply("Slow Soup")
+
+genai._session.post = fake_post
+genai._embed_session.post = fake_post
+threading.Thread(target=lambda: app.app_context().push() or run_suggestion("rice")).start()
+time.sleep(0.5)
+
+with app.app_context():
+    started = time.monotonic()
+    db.session.add(AIHistory(action_type="Suggestion", user_input="other", ai_output="x"))
+    db.session.commit()
+    print(round(time.monotonic() - started, 2))
+"""
+
+
+def test_ai_call_does_not_hold_sqlite_write_lock(tmp_path):
+    import os
+    import subprocess
+    import sys
+
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'lock.db'}")
+    result = subprocess.run(
+        [sys.executable, "-c", LOCK_SCRIPT], env=env, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)), timeout=30
+    )
+    assert result.returncode == 0, result.stderr
+    # Another request's commit must not wait for the in-flight generation call.
+    assert float(result.stdout.strip().splitlines()[-1]) < 0.5
+
+
+def test_cache_collision_keeps_history_row():
+    import genai
+    from app import finish_suggestion
+    from models import db, AICache, AIHistory
+
+    prompt_hash = genai._prompt_hash("model", 0.4, "collision prompt")
+    with app.app_context():
+        db.session.add(AICache(prompt_hash=prompt_hash, output="first worker"))
+        db.session.commit()
+
+    # Simulate losing the race: this request's lookup missed, another worker
+    # committed the row, and now this request stores its own answer.
+    with app.app_context():
+        genai._cache_store(prompt_hash, "second worker")
+        finish_suggestion("collision input", "Lemon Rice")
+        assert AIHistory.query.filter_by(user_input="collision input").count() == 1
+        assert db.session.get(AICache, prompt_hash).output == "first worker"
+
+
+def test_similar_ingredients_hit_semantic_cache(monkeypatch):
+    import genai
+    from models import db
+
+    calls = []
+    fake_openrouter(monkeypatch, calls)
+
+    with app.app_context():
+        assert genai.suggest_recipe("paneer, tomato") == "Tomato Soup"
+        db.session.commit()
+        assert genai.suggest_recipe("tomato,  paneer") == "Tomato Soup"
+
+    # Validation is never answered semantically; generation is.
+    assert len(calls) == 3
+
+
+def test_home_page_is_paginated():
+    from models import db, Recipe
+
+    with app.app_context():
+        db.session.add_all([
+            Recipe(
+                id=f"rec_page_{i:02d}",
+                name=f"Recipe {i}",
+                cuisine="Test",
+                isVegetarian=True,
+                prepTimeMinutes=10,
+                ingredients="rice",
+                difficulty="Easy",
+                instructions="Cook.",
+                tags="test"
+            )
+            for i in range(25)
+        ])
+        db.session.commit()
+
+    client = app.test_client()
+    first = client.get("/")
+    second = client.get("/?page=2")
+    assert b"Next" in first.data
+    assert b"Previous" in second.data
+
+
+def test_suggestion_runs_as_background_job(monkeypatch):
+    import time
+
+    calls = []
+    fake_openrouter(monkeypatch, calls)
+
+    client = app.test_client()
+    response = client.post("/ai/suggest", data={"ingredients": "rice, egg"})
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+
+    for _ in range(50):
+        result = client.get(f"/ai/result/{job_id}").get_json()
+        if result["status"] != "pending":
+            break
+        time.sleep(0.05)
+
+    assert result == {"status": "finished", "result": "Tomato Soup"}
+    assert client.get("/ai/result/not-a-job").status_code == 404
+
+
+def test_expired_jobs_are_pruned(monkeypatch):
+    from datetime import datetime, timedelta
+    import tasks
+    from models import db, AIJob
+
+    monkeypatch.setattr(tasks._executor, "submit", lambda *args: None)
+
+    with app.app_context():
+        db.session.add(AIJob(id="old", status="finished", result="x",
+                             created_at=datetime.utcnow() - tasks.JOB_TTL - timedelta(minutes=1)))
+        db.session.commit()
+        tasks.enqueue(app, len, "rice")
+        assert db.session.get(AIJob, "old") is None
+
+
+def test_job_timeout_counts_from_start_not_enqueue():
+    from datetime import datetime, timedelta
+    import tasks
+    from models import db, AIJob
+
+    long_ago = datetime.utcnow() - tasks.JOB_TIMEOUT - timedelta(minutes=1)
+    with app.app_context():
+        db.session.add(AIJob(id="queued", status="pending", created_at=long_ago))
+        db.session.add(AIJob(id="stuck", status="running", created_at=long_ago, started_at=long_ago))
+        db.session.add(AIJob(id="busy", status="running", created_at=long_ago,
+                             started_at=datetime.utcnow()))
+        db.session.commit()
+
+        assert tasks.get_result("queued") == {"status": "pending"}
+        assert tasks.get_result("stuck") == {"status": "failed"}
+        assert tasks.get_result("busy") == {"status": "pending"}
+
+
+def test_failed_result_commit_marks_job_failed(monkeypatch):
+    import tasks
+    from models import db, AIJob
+
+    with app.app_context():
+        db.session.add(AIJob(id="unrecordable", status="pending"))
+        db.session.commit()
+
+    record = tasks._record
+    attempts = []
+
+    def flaky_record(job_id, status, result):
+        attempts.append(status)
+        if status == "finished":
+            raise RuntimeError("disk full")
+        record(job_id, status, result)
+
+    monkeypatch.setattr(tasks, "_record", flaky_record)
+    tasks._run(app, "unrecordable", len, ("rice",))
+
+    with app.app_context():
+        assert attempts == ["finished", "failed"]
+        assert tasks.get_result("unrecordable") == {"status": "failed"}
+
+
+def test_failed_job_hides_error_details(monkeypatch):
+    import time
+
+    def boom(ingredients):
+        raise RuntimeError("upstream https://openrouter.ai/secret exploded")
+
+    monkeypatch.setattr("app.suggest_recipe", boom)
+
+    client = app.test_client()
+    job_id = client.post("/ai/suggest", data={"ingredients": "rice"}).get_json()["job_id"]
+
+    for _ in range(50):
+        result = client.get(f"/ai/result/{job_id}").get_json()
+        if result["status"] != "pending":
+            break
+        time.sleep(0.05)
+
+    assert result == {"status": "failed"}
+
+
+def test_suggestion_stream(monkeypatch):
+    def fake_stream(ingredients):
+        yield "Egg "
+        yield "Fried Rice"
+
+    monkeypatch.setattr("app.stream_suggestion", fake_stream)
+
+    client = app.test_client()
+    response = client.get("/ai/stream?ingredients=rice, egg")
+    assert response.mimetype == "text/event-stream"
+    body = response.get_data(as_text=True)
+    assert '"delta": "Egg "' in body
+    assert '"result": "Egg Fried Rice"' in body
+
+
+def test_uncommitted_answers_are_not_served_semantically(monkeypatch):
+    import genai
+    from models import db
+
+    calls = []
+    fake_openrouter(monkeypatch, calls)
+
+    with app.app_context():
+        assert genai.suggest_recipe("rice, onion") == "Tomato Soup"
+        db.session.rollback()
+        genai._cached_call.cache_clear()
+        assert genai.suggest_recipe("onion, rice") == "Tomato Soup"
+
+    # Both generations went to the API: the rolled-back answer was never indexed.
+    assert len([c for c in calls if c["max_tokens"] != 5]) == 2
+
+
+def test_simplify_skips_semantic_cache(monkeypatch):
+    import genai
+
+    calls = []
+    fake_openrouter(monkeypatch, calls)
+    monkeypatch.setattr(genai, "_embed", lambda text: pytest.fail("simplify must not embed"))
+
+    with app.app_context():
+        assert genai.simplify_recipe("Boil rice. Add paneer.") == "Tomato Soup"
+
+
+def test_semantic_index_is_bounded(monkeypatch):
+    import numpy as np
+    import genai
+
+    monkeypatch.setattr(genai, "SEMANTIC_MAX_ROWS", 300)
+    index = genai._SemanticIndex(2)
+    for i in range(301):
+        index.add(np.array([1.0, 0.0], dtype=np.float32), f"answer {i}")
+
+    assert len(index.outputs) == 300
+    assert index.matrix.shape == (300, 2)
+    # The oldest row was overwritten by the newest.
+    assert index.outputs[0] == "answer 300"
+
+
+def test_retry_after_is_capped():
+    import genai
+
+    class RateLimited:
+        headers = {"Retry-After": "3600"}
+
+        def getheader(self, name):
+            return self.headers.get(name)
+
+    retry = genai._session.get_adapter("https://openrouter.ai").max_retries
+    assert retry.read == 0
+    assert retry.get_retry_after(RateLimited()) == genai.RETRY_AFTER_MAX
+    assert genai._embed_session.get_adapter("https://openrouter.ai").max_retries.total == 0
+
+
+def test_streamed_completion_parses_sse(monkeypatch):
+    import genai
+
+    class FakeStream:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def raise_for_status(self):
+            pass
+
+        def iter_lines(self, decode_unicode=False):
+            return iter([
+                ": OPENROUTER PROCESSING",
+                'data: {"choices": [{"delta": {"content": "Egg "}}]}',
+                "",
+                'data: {"choices": [{"delta": {"content": "Curry"}}]}',
+                "data: [DONE]",
+            ])
+
+    calls = []
+    fake_openrouter(monkeypatch, calls)
+    post = genai._session.post
+    monkeypatch.setattr(genai._session, "post", lambda url, **kwargs: (
+        FakeStream() if kwargs.get("stream") else post(url, **kwargs)
+    ))
+
+    with app.app_context():
+        assert list(genai.stream_suggestion("egg, onion, paneer")) == ["Egg ", "Curry"]
+        assert genai.suggest_recipe("egg, onion, paneer") == "Egg Curry"
+
+
+def test_history_page_is_paginated():
+    from models import db, AIHistory
+
+    with app.app_context():
+        db.session.add_all([
+            AIHistory(action_type="Suggestion", user_input=f"input {i}", ai_output="output")
+            for i in range(60)
+        ])
+        db.session.commit()
+
+    client = app.test_client()
+    first = client.get("/history")
+    assert first.status_code == 200
+    assert b"input 59" in first.data
+    assert b"Older" in first.data
+    assert b"Newer" in client.get("/history?page=2").data
+
+
+def test_recipe_detail_page():
+    from models import db, Recipe
+
+    with app.app_context():
+        db.session.add(Recipe(
+            id="rec_detail",
+            name="Paneer Butter Masala",
+            cuisine="Indian",
+            isVegetarian=True,
+            prepTimeMinutes=40,
+            ingredients="paneer, tomato, butter, cream",
+            difficulty="Medium",
+            instructions="Cook tomatoes. Add paneer. Add cream and spices.",
+            tags="dinner,party"
+        ))
+        db.session.commit()
+
+    client = app.test_client()
+    response = client.get("/recipe/rec_detail")
+    assert response.status_code == 200
+    assert b"Paneer Butter Masala" in response.data
+    assert client.get("/recipe/rec_missing").status_code == 404
+
+
+def test_recipe_simplify_json(monkeypatch):
+    monkeypatch.setattr("app.get_recipe", lambda recipe_id: {
+        "id": recipe_id, "name": "Dal", "instructions": "Boil lentils."
+    })
+    monkeypatch.setattr("app.simplify_recipe", lambda instructions: "Boil the lentils.")
+
+    client = app.test_client()
+    response = client.post("/recipe/rec_dal", json={})
+    assert response.get_json() == {"recipe_id": "rec_dal", "simplified": "Boil the lentils."}
+
+
+def test_invalid_ingredients_detection():
+    from app import INVALID_RE
+
+    assert INVALID_RE.match("INVALID_INGREDIENTS")
+    assert INVALID_RE.match('  "INVALID_INGREDIENTS"')
+    assert not INVALID_RE.match("Tomato Soup. Unlike INVALID_INGREDIENTS, these are edible.")
+
+
+def test_invalid_ingredients_skip_generation(monkeypatch):
+    import genai
+
+    calls = []
+    fake_openrouter(monkeypatch, calls)
+    post = genai._session.post
+
+    def classify_invalid(url, **kwargs):
+        if url == genai.OPENROUTER_URL and kwargs["json"]["max_tokens"] == 5:
+            calls.append(kwargs["json"])
+            return FakeResponse({"choices": [{"message": {"content": "INVALID"}}]})
+        return post(url, **kwargs)
+
+    monkeypatch.setattr(genai._session, "post", classify_invalid)
+
+    with app.app_context():
+        assert genai.suggest_recipe("phone, chair") == "INVALID_INGREDIENTS"
+
+    assert len(calls) == 1